@@ -16,36 +16,45 @@ Usage:
   python netdiag.py --iperf3-server X.X.X.X
 """
 import argparse
+import asyncio
+import atexit
+import errno
+import io
 import json
+import math
 import os
 import platform
-import queue
 import random
+import re
+import selectors
 import shutil
+import signal
 import socket
-import statistics
+import struct
 import subprocess
 import sys
 import threading
 import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-# Available iperf3 servers with their ports
+# Available iperf3 servers with their ports (kept as ranges: no lists built at import)
 IPERF3_SERVERS = {
     "ping.online.net": {
         "description": "Scaleway France", 
-        "ports": list(range(5200, 5210))  # 5200-5209
+        "ports": range(5200, 5210)  # 5200-5209
     },
     "speedtest.milkywan.fr": {
         "description": "CBO France", 
-        "ports": list(range(9200, 9241))  # 9200-9240
+        "ports": range(9200, 9241)  # 9200-9240
     }, 
     "str.cubic.iperf.bytel.fr": {
         "description": "Bouygues France", 
-        "ports": list(range(9200, 9241))  # 9200-9240
+        "ports": range(9200, 9241)  # 9200-9240
     },
     "ch.iperf.014.fr": {
         "description": "HostHatch Switzerland", 
-        "ports": list(range(15315, 15321))  # 15315-15320
+        "ports": range(15315, 15321)  # 15315-15320
     }
 }
 
@@ -56,7 +65,7 @@ except ImportError:
     sys.exit(1)
 
 try:
-    import dns.resolver
+    import dns.asyncresolver
 except ImportError:
     print("Missing dependency: dnspython (pip install dnspython)")
     sys.exit(1)
@@ -66,109 +75,393 @@ try:
 except ImportError:
     miniupnpc = None
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import iperf3 as libiperf
+except ImportError:
+    libiperf = None
+
 try:
     import requests
+    from requests.adapters import HTTPAdapter
 except ImportError:
     print("Missing dependency: requests (pip install requests)")
     sys.exit(1)
 
 
+# Shared HTTP session so repeated public-IP lookups reuse the TLS connection
+_HTTP = requests.Session()
+_HTTP.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+
+# One /dev/null descriptor shared by every subprocess whose output is discarded
+_DEVNULL_FD = os.open(os.devnull, os.O_RDWR)
+atexit.register(os.close, _DEVNULL_FD)
+
+# External tools, resolved against PATH once instead of on every spawn
+IPERF3_BIN = shutil.which("iperf3") or "iperf3"
+PING_BIN = shutil.which("ping") or "ping"
+MTR_BIN = shutil.which("mtr")
+
+# Seconds a fetched public IP is reused before asking ipify again
+PUBLIC_IP_TTL = 60
+_public_ip_cache = (0.0, None)  # (monotonic timestamp, ip)
+
+
+def json_loads(data):
+    """
+    Parse JSON with orjson when it is installed, otherwise with the stdlib.
+    """
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def json_dumps(obj) -> str:
+    """
+    Pretty-print obj as JSON (2-space indent), with orjson when installed.
+    """
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2)
+
+
+# Jitter and lost/total datagrams of an iperf3 UDP summary line:
+# "[  5]   0.00-10.04  sec   119 MBytes  99.6 Mbits/sec  0.012 ms  0/86286 (0%)  receiver"
+IPERF3_UDP_SUMMARY_RE = re.compile(rb"([\d.]+) ms\s+(\d+)/(\d+)")
+
+
+def run_iperf3_udp(cmd, timeout=None):
+    """
+    Run an iperf3 UDP client command (plain-text output) and return the
+    receiver's {"jitter_ms", "lost_packets", "packets"}, or None if no
+    summary was printed. Only the final summary line is used, so none of
+    the per-interval reports --json would carry are ever parsed.
+    Raises subprocess.CalledProcessError on a non-zero exit status.
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=_DEVNULL_FD)
+    try:
+        out, _ = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    # Newer iperf3 prints a sender line before the receiver's; the last one wins
+    matches = IPERF3_UDP_SUMMARY_RE.findall(out)
+    if not matches:
+        return None
+    jitter, lost, total = matches[-1]
+    return {"jitter_ms": float(jitter), "lost_packets": int(lost), "packets": int(total)}
+
+
+# Whether the local iperf3 has --json-stream (3.16+); probed once on first use
+_iperf3_json_stream = None
+
+
+def iperf3_has_json_stream() -> bool:
+    """
+    Return True if the installed iperf3 supports --json-stream (3.16+).
+    'iperf3 --version' runs once per process; the answer is reused.
+    """
+    global _iperf3_json_stream
+    if _iperf3_json_stream is None:
+        try:
+            out = subprocess.check_output([IPERF3_BIN, "--version"], stderr=_DEVNULL_FD)
+            m = re.search(rb"iperf (\d+)\.(\d+)", out)
+            _iperf3_json_stream = bool(m) and (int(m[1]), int(m[2])) >= (3, 16)
+        except (OSError, subprocess.CalledProcessError):
+            _iperf3_json_stream = False
+    return _iperf3_json_stream
+
+
+def run_iperf3_json_stream(cmd, on_interval=None):
+    """
+    Run an iperf3 command with --json-stream --forceflush and parse its
+    line-delimited events as they arrive, calling on_interval(data) for each
+    interval report. Returns {"end": ...} as in iperf3's --json report.
+    Raises subprocess.CalledProcessError on a non-zero exit status.
+    """
+    cmd = cmd + ["--json-stream", "--forceflush"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=_DEVNULL_FD)
+    report = {}
+    try:
+        with proc.stdout:
+            for line in proc.stdout:
+                if not line.strip():
+                    continue
+                event = json_loads(line)
+                kind = event.get("event")
+                if kind == "interval" and on_interval:
+                    on_interval(event.get("data", {}))
+                elif kind == "end":
+                    report["end"] = event.get("data", {})
+    except BaseException:
+        # iperf3 ignores SIGPIPE; without this its load would outlive the test
+        proc.kill()
+        proc.wait()
+        raise
+    if proc.wait() != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return report
+
+
+# hostname -> IPv4 address, filled lazily by resolve_host()
+_RESOLVED_HOSTS = {}
+
+
+def resolve_host(host: str) -> str:
+    """
+    Resolve a hostname to an IPv4 address once and reuse it for the whole run.
+    Returns the hostname unchanged if resolution fails.
+    """
+    ip = _RESOLVED_HOSTS.get(host)
+    if ip is None:
+        try:
+            ip = socket.gethostbyname(host)
+        except OSError:
+            return host
+        _RESOLVED_HOSTS[host] = ip
+    return ip
+
+
 def test_server_connectivity(server: str, port: int, timeout: int = 3) -> bool:
     """
     Test if a port is open and accepting connections using a simple socket test.
     This is much faster and more reliable than running full iperf3 tests.
+    The probe costs one TCP handshake; the socket is closed on every path.
     """
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(timeout)
-        result = sock.connect_ex((server, port))
-        sock.close()
-        return result == 0  # 0 means connection successful
-    except Exception:
+        with socket.create_connection((resolve_host(server), port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+# connect_ex results meaning "still connecting"; Windows reports WSAEWOULDBLOCK
+_CONNECT_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK) + (
+    (errno.WSAEWOULDBLOCK,) if hasattr(errno, "WSAEWOULDBLOCK") else ())
+
+
+def probe_ports_bulk(pairs, timeout: float = 3, first: bool = False) -> set:
+    """
+    Probe many (host, port) pairs at once with nonblocking connects.
+    All sockets share a single deadline, so the sweep costs about one timeout
+    no matter how many ports are probed. Returns the set of pairs that accepted.
+    With first=True the sweep stops as soon as the earliest open pair (in
+    'pairs' order) is known, i.e. every pair before it has been refused.
+    """
+    pairs = list(pairs)
+    alive = set()
+    dead = set()
+
+    def first_known():
+        for pair in pairs:
+            if pair in alive:
+                return True
+            if pair not in dead:
+                return False
         return False
 
+    selector = selectors.DefaultSelector()
+    try:
+        for pair in pairs:
+            host, port = pair
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                err = sock.connect_ex((resolve_host(host), port))
+            except OSError:
+                sock.close()  # Unresolvable host
+                dead.add(pair)
+                continue
+            if err == 0:
+                alive.add(pair)
+                sock.close()
+            elif err in _CONNECT_IN_PROGRESS:
+                selector.register(sock, selectors.EVENT_WRITE, pair)
+            else:
+                dead.add(pair)
+                sock.close()
 
-def test_udp_support(server: str, port: int, timeout: int = 5) -> bool:
+        deadline = time.monotonic() + timeout
+        while selector.get_map() and not (first and first_known()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                sock = key.fileobj
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    alive.add(key.data)
+                else:
+                    dead.add(key.data)
+                selector.unregister(sock)
+                sock.close()
+    finally:
+        # Anything still registered never answered before the deadline
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+    return alive
+
+
+def test_udp_support(server: str, port: int, timeout: int = 3) -> bool:
     """
     Test if server supports UDP iperf3 tests by running a very short test.
+    Uses small datagrams at a low rate so the probe puts almost nothing on the wire.
     """
     try:
-        cmd = ["iperf3", "-c", server, "-p", str(port), "-u", "-b", "1M", "-t", "1", "--json"]
-        result = subprocess.run(cmd, capture_output=True, timeout=timeout)
-        if result.returncode == 0:
-            # Parse JSON to check if we got valid UDP results
-            try:
-                data = json.loads(result.stdout)
-                summary = data.get("end", {}).get("sum", {})
-                return (summary.get("jitter_ms") is not None and 
-                       summary.get("lost_packets") is not None and 
-                       summary.get("packets") is not None)
-            except (json.JSONDecodeError, KeyError):
-                return False
-        return False
+        cmd = [IPERF3_BIN, "-c", resolve_host(server), "-p", str(port), "-u",
+               "-l", "100", "-b", "100K", "-t", "1"]
+        # Valid UDP results include the receiver's jitter/loss summary
+        return run_iperf3_udp(cmd, timeout=timeout) is not None
     except (subprocess.TimeoutExpired, Exception):
         return False
 
 
-def select_best_server() -> tuple:
+# Last working server/port, reused across invocations for SERVER_CACHE_TTL seconds
+SERVER_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "netdiag", "best_server.json")
+SERVER_CACHE_TTL = 24 * 3600
+
+
+def load_server_cache(server: str = None, need_udp: bool = True):
+    """
+    Return the cached {"server", "port", "udp"} entry if it is fresh, matches
+    'server' (when given), has UDP support (when need_udp) and its port still
+    accepts a TCP connection. Returns None otherwise.
+    """
+    try:
+        with open(SERVER_CACHE_PATH) as f:
+            cached = json.load(f)
+        if time.time() - cached["ts"] >= SERVER_CACHE_TTL:
+            return None
+        if server is not None and cached["server"] != server:
+            return None
+        if need_udp and not cached["udp"]:
+            return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if not test_server_connectivity(cached["server"], cached["port"]):
+        return None
+    return cached
+
+
+def save_server_cache(server: str, port: int, udp: bool):
+    """
+    Remember a working server/port for later invocations; failures are ignored.
+    """
+    try:
+        os.makedirs(os.path.dirname(SERVER_CACHE_PATH), exist_ok=True)
+        with open(SERVER_CACHE_PATH, "w") as f:
+            json.dump({"ts": time.time(), "server": server, "port": port, "udp": udp}, f)
+    except OSError:
+        pass
+
+
+def select_best_server(check_udp: bool = True, cache: bool = True) -> tuple:
     """
     Test available servers and return the first one with both TCP and UDP support.
     Falls back to TCP-only servers if no UDP support is found.
+    With check_udp=False the first TCP-reachable port is returned without
+    running any iperf3 UDP probe. With cache, the choice is saved for
+    load_server_cache().
     """
     print("Testing iperf3 server connectivity...")
-    
-    # First pass: look for servers with both TCP and UDP support
-    for server, config in IPERF3_SERVERS.items():
-        description = config["description"]
-        ports = config["ports"]
-        
-        print(f"  Testing {server} ({description}) on ports {ports[0]}-{ports[-1]}...")
-        
-        # Try each port until we find one that works
-        for port in ports:
-            print(f"    Trying port {port}...", end=" ")
-            
-            # Test TCP connectivity first
-            if test_server_connectivity(server, port, timeout=3):
-                print("TCP ✓", end=" ")
-                
-                # Test UDP support
-                print("UDP...", end=" ")
-                if test_udp_support(server, port, timeout=5):
-                    print("✓")
-                    print(f"  → Selected {server}:{port} (TCP + UDP support)")
-                    return server, port
-                else:
-                    print("✗")
-                    print(f"    Port {port}: TCP works but no UDP support")
-            else:
-                print("TCP ✗")
-        
-        print(f"  → No working ports found on {server}")
-    
-    print("\n  No servers with UDP support found. Trying TCP-only servers...")
-    
-    # Second pass: fallback to TCP-only servers
+
+    # Resolve each host once up front; every probe below reuses the address
+    for server in IPERF3_SERVERS:
+        resolve_host(server)
+
+    candidates = [(server, port) for server, config in IPERF3_SERVERS.items()
+                  for port in config["ports"]]
+
+    # Fast path: stop probing once the highest-priority open port is known,
+    # instead of waiting out the deadline on filtered ports elsewhere
+    quick = probe_ports_bulk(candidates, first=True)
+    best = next((pair for pair in candidates if pair in quick), None)
+    tried_udp = None
+    if best:
+        server, port = best
+        if not check_udp:
+            print(f"  → Selected {server}:{port} (UDP check skipped)")
+            if cache:
+                save_server_cache(server, port, udp=False)
+            return server, port
+        print(f"    Trying {server}:{port} UDP...", end=" ")
+        if test_udp_support(server, port):
+            print("✓")
+            print(f"  → Selected {server}:{port} (TCP + UDP support)")
+            if cache:
+                save_server_cache(server, port, udp=True)
+            return server, port
+        print("✗")
+        tried_udp = best
+
+    # Probe every (server, port) pair in one nonblocking sweep; when nothing
+    # answered, the fast-path sweep above already was a complete one
+    alive = probe_ports_bulk(candidates) if best else quick
+    # Keep the configured priority order regardless of completion order
+    alive = [pair for pair in candidates if pair in alive]
+
     for server, config in IPERF3_SERVERS.items():
-        description = config["description"]
         ports = config["ports"]
-        
-        print(f"  Testing {server} ({description}) for TCP-only...")
-        
-        for port in ports:
-            print(f"    Trying port {port}...", end=" ")
-            if test_server_connectivity(server, port, timeout=3):
-                print("✓")
-                print(f"  → Selected {server}:{port} (TCP only - UDP may fail)")
-                return server, port
-            else:
-                print("✗")
-    
-    # If none respond, return the first server and first port anyway
-    fallback_server = list(IPERF3_SERVERS.keys())[0]
-    fallback_port = IPERF3_SERVERS[fallback_server]["ports"][0]
-    print(f"  No servers responded, using fallback: {fallback_server}:{fallback_port}")
-    return fallback_server, fallback_port
+        open_ports = [port for s, port in alive if s == server]
+        print(f"  {server} ({config['description']}): {len(open_ports)}/{len(ports)} "
+              f"ports open on {ports[0]}-{ports[-1]}")
+
+    if not alive:
+        # If none respond, return the first server and first port anyway
+        fallback_server = list(IPERF3_SERVERS.keys())[0]
+        fallback_port = IPERF3_SERVERS[fallback_server]["ports"][0]
+        print(f"  No servers responded, using fallback: {fallback_server}:{fallback_port}")
+        return fallback_server, fallback_port
+
+    if not check_udp:
+        server, port = alive[0]
+        print(f"  → Selected {server}:{port} (UDP check skipped)")
+        if cache:
+            save_server_cache(server, port, udp=False)
+        return server, port
+
+    # Second pass: the expensive UDP check only runs on ports that passed TCP,
+    # stopping at the first success
+    for server, port in alive:
+        if (server, port) == tried_udp:
+            continue
+        print(f"    Trying {server}:{port} UDP...", end=" ")
+        if test_udp_support(server, port):
+            print("✓")
+            print(f"  → Selected {server}:{port} (TCP + UDP support)")
+            if cache:
+                save_server_cache(server, port, udp=True)
+            return server, port
+        print("✗")
+
+    # Fallback to the first TCP-only port
+    server, port = alive[0]
+    print("\n  No servers with UDP support found.")
+    print(f"  → Selected {server}:{port} (TCP only - UDP may fail)")
+    if cache:
+        save_server_cache(server, port, udp=False)
+    return server, port
+
+
+def find_spare_port(server: str, exclude: int):
+    """
+    Return another open iperf3 port on a listed server besides 'exclude',
+    so a second client can load the link at the same time, or None.
+    """
+    config = IPERF3_SERVERS.get(server)
+    if not config:
+        return None
+    pairs = [(server, port) for port in config["ports"] if port != exclude]
+    alive = probe_ports_bulk(pairs, first=True)
+    for pair in pairs:
+        if pair in alive:
+            return pair[1]
+    return None
 
 
 def list_servers():
@@ -186,96 +479,348 @@ def list_servers():
         print(f"  {server:<30} - {description} ({port_display})")
 
 
-def measure_ping(target: str, interval: float, duration: float):
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+# Linux <netinet/in.h> values; the socket module does not export them
+IP_MTU_DISCOVER = 10
+IP_PMTUDISC_DO = 2
+IP_MTU = 14
+
+
+def icmp_checksum(data: bytes) -> int:
     """
-    Send ICMP pings via ping3.ping() every 'interval' seconds for 'duration' seconds.
-    Returns list of RTTs in milliseconds (drops are omitted).
+    RFC 1071 Internet checksum of an ICMP message.
     """
-    end = time.monotonic() + duration
-    delays = []
-    while time.monotonic() < end:
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+class IcmpPinger:
+    """
+    ICMP echo over one long-lived unprivileged (SOCK_DGRAM) ICMP socket.
+    Avoids the socket setup/teardown ping3 does for every single ping.
+    Raises OSError if the OS does not allow unprivileged ping sockets.
+    With df=True (Linux only) packets carry the Don't Fragment bit and sends
+    larger than the known path MTU fail with EMSGSIZE.
+    """
+
+    def __init__(self, host: str, df: bool = False):
+        self.addr = resolve_host(host)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        if df:
+            try:
+                self.sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+            except OSError:
+                self.sock.close()
+                raise
+        self.sock.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.ident = os.getpid() & 0xFFFF
+        self.seq = 0
+        self.send_ts = {}
+
+    def ping(self, timeout: float = 1, size: int = 56):
+        """
+        Send one echo request with a 'size'-byte payload and wait for its reply.
+        Returns the RTT in seconds, or None on timeout.
+        """
+        self.seq = (self.seq + 1) & 0xFFFF
+        seq = self.seq
+        payload = bytes(size)
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, self.ident, seq)
+        checksum = icmp_checksum(header + payload)
+        packet = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum, self.ident, seq) + payload
+        self.send_ts[seq] = time.monotonic()
+        deadline = self.send_ts[seq] + timeout
         try:
-            r = ping(target, timeout=1)
-        except Exception:
-            r = None
-        if r is not None:
-            delays.append(r * 1000.0)
-        time.sleep(interval)
-    return delays
+            self.sock.sendto(packet, (self.addr, 0))
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.selector.select(remaining):
+                    return None
+                for reply_seq, rtt in self._drain():
+                    if reply_seq == seq:
+                        return rtt
+        finally:
+            # Late replies for this sequence number are counted as drops
+            self.send_ts.pop(seq, None)
+
+    def _drain(self):
+        """Read every pending reply and yield (seq, rtt) for outstanding requests."""
+        while True:
+            try:
+                data = self.sock.recv(2048)
+            except BlockingIOError:
+                return
+            now = time.monotonic()
+            # macOS includes the IP header on ICMP datagram sockets, Linux does not
+            if len(data) >= 20 and data[0] >> 4 == 4:
+                data = data[(data[0] & 0x0F) * 4:]
+            if len(data) < 8:
+                continue
+            icmp_type, _code, _csum, _ident, reply_seq = struct.unpack("!BBHHH", data[:8])
+            # Linux rewrites the identifier, so replies are matched on sequence only
+            if icmp_type == ICMP_ECHO_REPLY and reply_seq in self.send_ts:
+                yield reply_seq, now - self.send_ts.pop(reply_seq)
+
+    def close(self):
+        self.selector.close()
+        self.sock.close()
+
+
+def open_pinger(host: str, df: bool = False):
+    """
+    Return an IcmpPinger for host, or None when ping sockets are unavailable
+    (callers then fall back to ping3).
+    """
+    try:
+        return IcmpPinger(host, df=df)
+    except OSError:
+        return None
+
+
+def ping_ticks(target: str, interval: float, duration: float, pinger=None):
+    """
+    Ping 'target' on a fixed 'interval' schedule for 'duration' seconds,
+    yielding one RTT in seconds (None for a drop) per tick. Sends follow the
+    schedule, so the RTT of each ping does not stretch the sample spacing.
+    A pinger passed in is used but left open for the caller to close.
+    """
+    target = resolve_host(target)
+    own_pinger = pinger is None
+    if own_pinger:
+        pinger = open_pinger(target)
+    next_tick = time.monotonic()
+    end = next_tick + duration
+    try:
+        while next_tick < end:
+            next_tick += interval
+            try:
+                r = pinger.ping(timeout=1) if pinger else ping(target, timeout=1)
+            except Exception:
+                r = None
+            yield r
+            dt = next_tick - time.monotonic()
+            if dt > 0:
+                time.sleep(dt)
+            else:
+                # A timed-out ping overran its slot; resync rather than burst
+                next_tick = time.monotonic()
+    finally:
+        if own_pinger and pinger:
+            pinger.close()
+
+
+# RTT field of a ping reply line: "time=12.3 ms" (Unix), "time=12ms"/"time<1ms" (Windows)
+PING_RTT_RE = re.compile(rb"time[=<]\s*([\d.]+)\s*ms")
+
+
+def measure_ping_subprocess(target: str, interval: float, duration: float):
+    """
+    Ping with the system ping binary: one process sends every probe on the
+    kernel's schedule and its output is parsed line by line as it arrives.
+    Returns list of RTTs in milliseconds, or None if nothing could be measured.
+    Windows ping has a fixed one-second interval.
+    """
+    system = platform.system().lower()
+    deadline = str(math.ceil(duration))
+    if system == "windows":
+        cmd = [PING_BIN, "-n", deadline, "-w", "1000", target]
+    elif system == "darwin":
+        cmd = [PING_BIN, "-i", str(interval), "-t", deadline, target]
+    else:
+        cmd = [PING_BIN, "-i", str(interval), "-w", deadline, target]
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=_DEVNULL_FD, bufsize=0)
+    except OSError:
+        return None
+    delays = []
+    for line in proc.stdout:
+        m = PING_RTT_RE.search(line)
+        if m:
+            delays.append(float(m.group(1)))
+    proc.wait()
+    # e.g. unprivileged users may not ping faster than every 200 ms
+    return delays or None
 
 
-def bufferbloat_test(server: str, port: int, ping_host: str, duration: int = 10, ping_interval: float = 0.1):
+def measure_ping(target: str, interval: float, duration: float, pinger: IcmpPinger = None):
+    """
+    Send ICMP pings every 'interval' seconds for 'duration' seconds.
+    Uses the in-process ICMP socket when the OS allows it, else the system
+    ping binary, and ping3 as the last resort. A caller-supplied pinger is
+    reused and left open, so one socket can serve several measurements.
+    Returns list of RTTs in milliseconds (drops are omitted).
+    """
+    target = resolve_host(target)
+    own = pinger is None
+    if own:
+        pinger = open_pinger(target)
+    if pinger is None:
+        delays = measure_ping_subprocess(target, interval, duration)
+        if delays is not None:
+            return delays
+    try:
+        return [r * 1000.0 for r in ping_ticks(target, interval, duration, pinger=pinger)
+                if r is not None]
+    finally:
+        if own and pinger:
+            pinger.close()
+
+
+def wait_for_quiescence(host: str, baseline_avg: float, tol: float = 0.10,
+                        stable_s: float = 2, cap_s: float = 15, interval: float = 0.1) -> float:
+    """
+    Wait until RTT to host has stayed within 'tol' of baseline_avg for
+    'stable_s' seconds, so queues drained after a load test do not leak into
+    the next run. Gives up after 'cap_s' seconds. Returns seconds waited.
+    """
+    start = time.monotonic()
+    limit = baseline_avg * (1 + tol)
+    stable_since = None
+    samples = ping_ticks(host, interval, cap_s)
+    try:
+        for r in samples:
+            now = time.monotonic()
+            if r is None or r * 1000.0 > limit:
+                stable_since = None
+            elif stable_since is None:
+                stable_since = now
+            elif now - stable_since >= stable_s:
+                break
+    finally:
+        samples.close()
+    return time.monotonic() - start
+
+
+def mean_sd(values) -> tuple:
+    """
+    Return (mean, sample standard deviation) of a non-empty list of floats,
+    computed in one pass with Welford's algorithm. A single value has sd 0.
+    """
+    mean = 0.0
+    m2 = 0.0
+    for n, x in enumerate(values, 1):
+        delta = x - mean
+        mean += delta / n
+        m2 += delta * (x - mean)
+    n = len(values)
+    return mean, math.sqrt(m2 / (n - 1)) if n > 1 else 0.0
+
+
+def bufferbloat_test(server: str, port: int, ping_host: str, duration: int = 10, ping_interval: float = 0.1,
+                     streams: int = 8, omit: int = 2, concurrent_port: int = None):
     """
     Measure baseline ping, then ping under iperf3 TCP load (upload & download).
+    The load uses 'streams' parallel TCP flows so a single flow's congestion
+    window does not cap it below link rate, and the first 'omit' seconds
+    (TCP slow start) are excluded from both iperf3 and the ping samples.
+    With 'concurrent_port', upload (to 'port') and download (from
+    'concurrent_port') run at the same time, saving one load period. The
+    pings then see both queues at once, so the reported increase applies to
+    the combined load and cannot be attributed to either direction; ACKs of
+    each direction also compete with the other's data, so sequential runs
+    remain the more accurate measurement.
     Returns a dict of stats.
     """
     print("\n=== Bufferbloat Test ===")
-    # 1) Baseline
-    print(f"Measuring baseline ping to {ping_host} for {duration}s...")
-    base = measure_ping(ping_host, ping_interval, duration)
-    if not base:
-        print("  ERROR: No replies during baseline ping.")
-        return None
-    base_avg = statistics.mean(base)
-    base_sd = statistics.stdev(base) if len(base) > 1 else 0.0
-    print(f"  Baseline RTT: avg={base_avg:.1f} ms  sd={base_sd:.1f} ms")
-
-    results = {"baseline_avg": base_avg, "baseline_sd": base_sd, "upload_avg": None,
-               "download_avg": None}
-
-    def run_load_and_ping(cmd):
-        # Measure ping concurrently while iperf3 runs.
-        loaded = []
-
-        def do_ping():
-            endt = time.monotonic() + duration
-            while time.monotonic() < endt:
-                try:
-                    r = ping(ping_host, timeout=1)
-                    if r is not None:
-                        loaded.append(r * 1000.0)
-                except Exception:
-                    pass  # Skip failed pings
-                time.sleep(ping_interval)
-
-        th = threading.Thread(target=do_ping)
-        th.start()
-        # Launch iperf3
-        try:
-            with open(os.devnull, "w") as devnull:
-                proc = subprocess.Popen(cmd, stdout=devnull, stderr=devnull)
-                proc.wait()
-        except Exception as e:
-            print(f"  ERROR running iperf3: {e}")
-        th.join()
-        return loaded
-
-    # 2) Upload saturation
-    print(f"Running iperf3 TCP upload saturate to {server}:{port} for {duration}s...")
-    cmd_up = ["iperf3", "-c", server, "-p", str(port), "-t", str(duration)]
-    up_ping = run_load_and_ping(cmd_up)
-    if up_ping:
-        up_avg = statistics.mean(up_ping)
-        results["upload_avg"] = up_avg
-        print(f"  Upload-loaded RTT avg={up_avg:.1f} ms  ↑{up_avg-base_avg:.1f} ms")
-    else:
-        print("  ERROR: No ping replies during upload test.")
-
-    # 3) Download saturation
-    print(f"Running iperf3 TCP download saturate (-R) from {server}:{port} for {duration}s...")
-    cmd_down = ["iperf3", "-c", server, "-p", str(port), "-R", "-t", str(duration)]
-    down_ping = run_load_and_ping(cmd_down)
-    if down_ping:
-        down_avg = statistics.mean(down_ping)
-        results["download_avg"] = down_avg
-        print(f"  Download-loaded RTT avg={down_avg:.1f} ms  ↑{down_avg-base_avg:.1f} ms")
-    else:
-        print("  ERROR: No ping replies during download test.")
+    # One ICMP socket for baseline, upload and download sampling
+    pinger = open_pinger(resolve_host(ping_host))
+    try:
+        # 1) Baseline
+        print(f"Measuring baseline ping to {ping_host} for {duration}s...")
+        base = measure_ping(ping_host, ping_interval, duration, pinger)
+        if not base:
+            print("  ERROR: No replies during baseline ping.")
+            return None
+        base_avg, base_sd = mean_sd(base)
+        print(f"  Baseline RTT: avg={base_avg:.1f} ms  sd={base_sd:.1f} ms")
+
+        results = {"baseline_avg": base_avg, "baseline_sd": base_sd, "upload_avg": None,
+                   "download_avg": None, "upload_increase": None, "download_increase": None}
 
-    # Grade
-    inc_up = (results["upload_avg"] or base_avg) - base_avg
-    inc_down = (results["download_avg"] or base_avg) - base_avg
-    worst_inc = max(inc_up, inc_down)
+        def run_load_and_ping(*cmds):
+            # Measure ping concurrently while the iperf3 client(s) run.
+            loaded = []
+
+            def do_ping():
+                time.sleep(omit)  # Let the queue fill before sampling
+                loaded.extend(measure_ping(ping_host, ping_interval, duration, pinger))
+
+            th = threading.Thread(target=do_ping)
+            th.start()
+            # Launch iperf3
+            try:
+                procs = [subprocess.Popen(cmd, stdout=_DEVNULL_FD, stderr=_DEVNULL_FD) for cmd in cmds]
+                for proc in procs:
+                    proc.wait()
+            except Exception as e:
+                print(f"  ERROR running iperf3: {e}")
+            th.join()
+            return loaded
+
+        cmd_up = [IPERF3_BIN, "-c", resolve_host(server), "-p", str(port), "-t", str(duration),
+                  "-P", str(streams), "--omit", str(omit)]
+        if concurrent_port:
+            # 2+3) Upload and download saturation at once, on two server ports
+            print(f"Running iperf3 TCP upload to {server}:{port} and download (-R) from "
+                  f"{server}:{concurrent_port} concurrently for {duration}s...")
+            cmd_down = [IPERF3_BIN, "-c", resolve_host(server), "-p", str(concurrent_port), "-R",
+                        "-t", str(duration), "-P", str(streams), "--omit", str(omit)]
+            loaded = run_load_and_ping(cmd_up, cmd_down)
+            # Neither direction can be isolated; per-direction fields stay None
+            results["concurrent_load"] = True
+            results["combined_avg"] = None
+            results["combined_increase"] = None
+            if loaded:
+                avg = sum(loaded) / len(loaded)
+                results["combined_avg"] = avg
+                results["combined_increase"] = avg - base_avg
+                print(f"  Bidirectional-loaded RTT avg={avg:.1f} ms  ↑{avg-base_avg:.1f} ms")
+            else:
+                print("  ERROR: No ping replies during concurrent load test.")
+            return grade_bufferbloat(results)
+
+        # 2) Upload saturation
+        print(f"Running iperf3 TCP upload saturate to {server}:{port} for {duration}s...")
+        up_ping = run_load_and_ping(cmd_up)
+        if up_ping:
+            up_avg = sum(up_ping) / len(up_ping)
+            results["upload_avg"] = up_avg
+            results["upload_increase"] = up_avg - base_avg
+            print(f"  Upload-loaded RTT avg={up_avg:.1f} ms  ↑{up_avg-base_avg:.1f} ms")
+        else:
+            print("  ERROR: No ping replies during upload test.")
+
+        # 3) Download saturation
+        print(f"Running iperf3 TCP download saturate (-R) from {server}:{port} for {duration}s...")
+        cmd_down = [IPERF3_BIN, "-c", resolve_host(server), "-p", str(port), "-R", "-t", str(duration),
+                    "-P", str(streams), "--omit", str(omit)]
+        down_ping = run_load_and_ping(cmd_down)
+        if down_ping:
+            down_avg = sum(down_ping) / len(down_ping)
+            results["download_avg"] = down_avg
+            results["download_increase"] = down_avg - base_avg
+            print(f"  Download-loaded RTT avg={down_avg:.1f} ms  ↑{down_avg-base_avg:.1f} ms")
+        else:
+            print("  ERROR: No ping replies during download test.")
+
+        return grade_bufferbloat(results)
+    finally:
+        if pinger:
+            pinger.close()
+
+
+def grade_bufferbloat(results: dict) -> dict:
+    """Grade bufferbloat results by the worst loaded RTT increase."""
+    worst_inc = max(results["upload_increase"] or 0.0, results["download_increase"] or 0.0,
+                    results.get("combined_increase") or 0.0)
     if worst_inc < 30:
         grade = "A"
     elif worst_inc < 100:
@@ -287,16 +832,73 @@ def bufferbloat_test(server: str, port: int, ping_host: str, duration: int = 10,
     return results
 
 
+def parse_bitrate(bw: str) -> int:
+    """
+    Convert an iperf3-style bitrate such as '100M' or '512K' to bits/s.
+    """
+    units = {"K": 10**3, "M": 10**6, "G": 10**9}
+    bw = bw.strip().upper()
+    if bw and bw[-1] in units:
+        return int(float(bw[:-1]) * units[bw[-1]])
+    return int(float(bw))
+
+
+def run_libiperf_udp(server: str, port: int, duration: int, bw: str):
+    """
+    Run a UDP test in-process through libiperf (the iperf3 PyPI package)
+    instead of spawning the iperf3 binary. Must be called from the main
+    thread. Returns a dict with jitter_ms, lost_packets and packets, or None
+    when libiperf is unavailable, in which case the caller runs the binary.
+    A failed test raises RuntimeError rather than being run a second time.
+    """
+    if libiperf is None:
+        return None
+    try:
+        client = libiperf.Client()
+    except OSError:
+        return None  # The wrapper is installed but libiperf.so is not
+    client.server_hostname = resolve_host(server)
+    client.port = port
+    client.protocol = "udp"
+    client.bandwidth = parse_bitrate(bw)
+    client.duration = duration
+
+    # run() points fd 1 at a pipe for the whole test: push out pending output
+    sys.stdout.flush()
+    # libiperf installs its own SIGINT/SIGTERM handlers and never removes them
+    handlers = {sig: signal.getsignal(sig) for sig in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        result = client.run()
+    finally:
+        for sig, handler in handlers.items():
+            if handler is not None:
+                signal.signal(sig, handler)
+    if result is None or result.error:
+        raise RuntimeError(f"libiperf: {result.error if result else 'no result'}")
+    return {"jitter_ms": result.jitter_ms, "lost_packets": result.lost_packets,
+            "packets": result.packets}
+
+
 def jitter_test(server: str, port: int, duration: int = 10, bw: str = "100M"):
     """
     Run iperf3 UDP test. Returns jitter, lost, total.
     """
     print("\n=== Jitter & Packet Loss Test (iperf3 UDP) ===")
-    cmd = ["iperf3", "-c", server, "-p", str(port), "-u", "-b", bw, "-t", str(duration), "--json"]
+    cmd = [IPERF3_BIN, "-c", resolve_host(server), "-p", str(port), "-u", "-b", bw, "-t", str(duration)]
+
+    def show_interval(data):
+        interval = data.get("sum", {})
+        print(f"  {interval.get('end', 0):4.1f}s  {interval.get('bits_per_second', 0) / 1e6:7.1f} Mbit/s  "
+              f"{interval.get('packets', 0)} packets")
+
     try:
-        out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
-        data = json.loads(out)
-        summary = data.get("end", {}).get("sum", {})
+        summary = run_libiperf_udp(server, port, duration, bw)
+        if summary is None:
+            if iperf3_has_json_stream():
+                report = run_iperf3_json_stream(cmd, on_interval=show_interval)
+                summary = report.get("end", {}).get("sum", {})
+            else:
+                summary = run_iperf3_udp(cmd) or {}
         jitter = summary.get("jitter_ms")
         lost = summary.get("lost_packets")
         total = summary.get("packets")
@@ -309,7 +911,9 @@ def jitter_test(server: str, port: int, duration: int = 10, bw: str = "100M"):
         print(f"  Jitter: {jitter:.1f} ms; Lost: {lost}/{total}")
         status = "OK" if jitter < 20 and lost == 0 else "WARN"
         print(f"  Status: {status}")
-        return {"jitter_ms": jitter, "lost": lost, "total": total, "status": status}
+        loss_pct = 100.0 * lost / total if total else None
+        return {"jitter_ms": jitter, "lost": lost, "total": total, "loss_pct": loss_pct,
+                "status": status}
     except subprocess.CalledProcessError as e:
         print(f"  ERROR: iperf3 UDP test failed (exit code {e.returncode})")
         return None
@@ -321,75 +925,101 @@ def jitter_test(server: str, port: int, duration: int = 10, bw: str = "100M"):
         return None
 
 
+# One 'mtr -r' hop row: "  3.|-- host name  0.0%  10  1.2  1.3  1.1  1.9  0.2".
+# The host is matched lazily so the trailing seven numeric columns anchor it.
+MTR_ROW_RE = re.compile(
+    r"\s*(\d+)\.[|`]--\s+(.*?)\s+([\d.]+)%?\s+(\d+)"
+    r"\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s*$"
+)
+
+
+def parse_mtr_report(out: str):
+    """
+    Parse 'mtr -r' text output into hub dicts shaped like mtr --json's.
+    Lines that are not hop rows (the Start:/HOST: header) do not match.
+    """
+    hubs = []
+    _append = hubs.append
+    match = MTR_ROW_RE.match
+    for line in out.splitlines():
+        m = match(line)
+        if m:
+            _append({
+                "count": int(m[1]),
+                "host": m[2],
+                "Loss%": float(m[3]),
+                "Snt": int(m[4]),
+                "Last": float(m[5]),
+                "Avg": float(m[6]),
+                "Best": float(m[7]),
+                "Wrst": float(m[8]),
+                "StDev": float(m[9]),
+            })
+    return hubs
+
+
 def mtr_test(target: str = "8.8.8.8", count: int = 100):
     """
-    Run mtr -r -c count target and parse output for comprehensive hop analysis.
+    Run mtr --json -c count target (falling back to the -r text report on
+    builds without --json) and parse output for comprehensive hop analysis.
     Enhanced for ISP troubleshooting with detailed statistics.
     """
     print("\n=== MTR Test ===")
-    mtr_bin = shutil.which("mtr")
-    if not mtr_bin:
+    if not MTR_BIN:
         print("  mtr not installed; skipping.")
         print("  Install with: brew install mtr (macOS) or apt install mtr (Linux)")
         return None
     
     print(f"  Running MTR to {target} with {count} packets...")
-    cmd = [mtr_bin, "-r", "-c", str(count), target]
+    # --json is itself a report mode; adding -r after it would switch back to text
+    cmd = [MTR_BIN, "--json", "-c", str(count), target]
     try:
-        out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL, universal_newlines=True)
-        lines = out.strip().splitlines()
+        try:
+            out = subprocess.check_output(cmd, stderr=_DEVNULL_FD, universal_newlines=True)
+            hubs = json_loads(out).get("report", {}).get("hubs", [])
+        except subprocess.CalledProcessError:
+            # Older mtr builds lack --json; use the plain-text report instead
+            cmd = [MTR_BIN, "-r", "-c", str(count), target]
+            out = subprocess.check_output(cmd, stderr=_DEVNULL_FD, universal_newlines=True)
+            hubs = parse_mtr_report(out)
         
-        if len(lines) < 2:
+        if not hubs:
             print("  ERROR: No MTR data received")
             return None
             
-        header = lines[0]
-        print("  " + header)
+        print(f"  {'Hop':>4} {'Host':<40} {'Loss%':>6} {'Snt':>5} {'Last':>6} "
+              f"{'Avg':>6} {'Best':>6} {'Wrst':>6} {'StDev':>6}")
         
         hops = []
         problem_hops = []
         
-        for line in lines[1:]:
-            parts = line.split()
-            if len(parts) >= 8 and parts[0].isdigit():
-                hop = int(parts[0])
-                loss = float(parts[1].strip("%"))
-                avg = float(parts[4])
-                stdev = float(parts[7])
-                
-                # Additional MTR fields for comprehensive analysis
-                sent = int(parts[2]) if len(parts) > 2 else count
-                last = float(parts[3]) if len(parts) > 3 else avg
-                best = float(parts[5]) if len(parts) > 5 else avg
-                worst = float(parts[6]) if len(parts) > 6 else avg
-                
-                hop_data = {
-                    'hop': hop,
-                    'loss': loss,
-                    'avg': avg,
-                    'stdev': stdev,
-                    'last': last,
-                    'best': best,
-                    'worst': worst,
-                    'sent': sent
-                }
-                
-                hops.append((hop, loss, avg, stdev))
-                
-                # Flag problematic hops for ISP evidence
-                flags = []
-                if loss > 0:
-                    flags.append("🔴 LOSS")
-                    problem_hops.append(f"Hop {hop}: {loss:.1f}% packet loss")
-                if stdev > 20:  # High jitter threshold
-                    flags.append("🟡 HIGH-JITTER")
-                    problem_hops.append(f"Hop {hop}: {stdev:.1f}ms jitter")
-                if worst - best > 100:  # High latency variation
-                    flags.append("🟠 LATENCY-VAR")
-                    problem_hops.append(f"Hop {hop}: {worst-best:.1f}ms latency variation")
-                
-                flag_str = " " + " ".join(flags) if flags else ""
-                print(f"  {line}{flag_str}")
+        for h in hubs:
+            hop = int(h["count"])
+            loss = float(h["Loss%"])
+            avg = float(h["Avg"])
+            stdev = float(h["StDev"])
+            sent = int(h.get("Snt", count))
+            last = float(h.get("Last", avg))
+            best = float(h.get("Best", avg))
+            worst = float(h.get("Wrst", avg))
+            
+            hops.append((hop, loss, avg, stdev))
+            
+            # Flag problematic hops for ISP evidence
+            flags = []
+            if loss > 0:
+                flags.append("🔴 LOSS")
+                problem_hops.append(f"Hop {hop}: {loss:.1f}% packet loss")
+            if stdev > 20:  # High jitter threshold
+                flags.append("🟡 HIGH-JITTER")
+                problem_hops.append(f"Hop {hop}: {stdev:.1f}ms jitter")
+            if worst - best > 100:  # High latency variation
+                flags.append("🟠 LATENCY-VAR")
+                problem_hops.append(f"Hop {hop}: {worst-best:.1f}ms latency variation")
+            
+            flag_str = " " + " ".join(flags) if flags else ""
+            print(f"  {hop:>3}. {h.get('host', '???'):<40} {loss:5.1f}% {sent:>5} {last:>6.1f} "
+                  f"{avg:>6.1f} {best:>6.1f} {worst:>6.1f} {stdev:>6.1f}{flag_str}")
                 
         # Summary for ISP troubleshooting
         if problem_hops:
@@ -409,40 +1039,117 @@ def mtr_test(target: str = "8.8.8.8", count: int = 100):
         return None
 
 
+# ICMP payload sizes (MTU - 28) for common link tiers: Ethernet, PPPoE,
+# 6in4/GRE, VPN, IPv6 minimum, and a conservative floor. Probed before any
+# bisection; the bisection itself stays byte-exact since tunnel MTUs such as
+# 1480 are not multiples of 8 payload bytes from 1472.
+MTU_PROBE_SIZES = (1472, 1464, 1452, 1400, 1280, 1024)
+
+
+def find_max_payload(probe, max_size: int = None):
+    """
+    Return the largest ICMP payload size for which probe(size) succeeds.
+    Common MTU tiers are tried first (usually a single probe); binary search
+    only runs between the largest passing and smallest failing tier.
+    A known upper bound 'max_size' below the top tier is probed first.
+    """
+    sizes = MTU_PROBE_SIZES
+    if max_size is not None and max_size < sizes[0]:
+        sizes = (max_size,) + tuple(size for size in sizes if size < max_size)
+    passing = None
+    failing = None
+    for size in sizes:
+        if probe(size):
+            passing = size
+            break
+        failing = size
+    if failing is None:
+        return passing
+
+    low = passing + 1 if passing is not None else 0
+    high = failing - 1
+    while low <= high:
+        mid = (low + high) // 2
+        if probe(mid):
+            passing = mid
+            low = mid + 1
+        else:
+            high = mid - 1
+    return passing
+
+
+def kernel_path_mtu(host: str):
+    """
+    Return the kernel's path MTU estimate towards host (Linux), or None.
+    Connecting a UDP socket sends nothing but binds a route, and IP_MTU then
+    reports that route's MTU or a cached smaller PMTU. Smaller MTUs further
+    along the path are only known after an ICMP "fragmentation needed", so
+    this is an upper bound that the DF probes still confirm.
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+            sock.connect((resolve_host(host), 33434))
+            return sock.getsockopt(socket.IPPROTO_IP, IP_MTU)
+    except OSError:
+        return None
+
+
+def probe_df(pinger, size: int) -> bool:
+    """
+    Send one Don't-Fragment echo of 'size' payload bytes; True if it came back.
+    """
+    try:
+        return pinger.ping(timeout=1, size=size) is not None
+    except OSError:
+        return False  # EMSGSIZE: larger than the known path MTU
+
+
+# Per-platform ping flags for DF probes:
+# (don't-fragment args, payload size flag, count flag, one-second reply wait)
+_PING_ARGS = {
+    "linux": (["-M", "do"], "-s", "-c", ["-W", "1"]),
+    "windows": (["-f"], "-l", "-n", ["-w", "1000"]),
+    "darwin": (["-D"], "-s", "-c", ["-W", "1000"]),
+}
+
+
 def mtu_test(host: str = "8.8.8.8"):
     """
     Discover path MTU by ping with DF. Returns MTU in bytes.
-    Linux uses "-M do -c1 -s size", Windows "-f -l size -n1".
+    On Linux, probes go over an in-process ICMP socket with IP_PMTUDISC_DO;
+    otherwise the ping binary is used with the flags from _PING_ARGS.
     """
     print("\n=== MTU Discovery Test ===")
     system = platform.system().lower()
-    if system.startswith("linux"):
-        df_args = ["-M", "do"]
-        size_flag = "-s"
-        count_flag = "-c"
-    elif system.startswith("windows"):
-        df_args = ["-f"]
-        size_flag = "-l"
-        count_flag = "-n"
-    else:
+    if system not in _PING_ARGS:
         print("  MTU test unsupported on", system)
         return None
 
-    # IP+ICMP overhead ~= 28 bytes; start at 1472
-    low, high = 0, 1472
-    mtu = None
-    while low <= high:
-        mid = (low + high) // 2
-        if system.startswith("linux"):
-            cmd = ["ping", *df_args, count_flag, "1", size_flag, str(mid), host]
-        else:
-            cmd = ["ping", *df_args, count_flag, "1", size_flag, str(mid), host]
-        res = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        if res.returncode == 0:
-            mtu = mid + 28
-            low = mid + 1
-        else:
-            high = mid - 1
+    pinger = open_pinger(host, df=True) if system == "linux" else None
+    if pinger:
+        def probe(size):
+            return probe_df(pinger, size)
+    else:
+        df_args, size_flag, count_flag, wait_args = _PING_ARGS[system]
+        cmd = [PING_BIN, *df_args, *wait_args, count_flag, "1", size_flag, "", host]
+        size_index = len(cmd) - 2
+
+        def probe(size):
+            cmd[size_index] = str(size)
+            res = subprocess.run(cmd, stdout=_DEVNULL_FD, stderr=_DEVNULL_FD)
+            return res.returncode == 0
+
+    # Start from the kernel's own PMTU estimate where one is available
+    route_mtu = kernel_path_mtu(host) if system == "linux" else None
+
+    try:
+        # IP+ICMP overhead ~= 28 bytes
+        payload = find_max_payload(probe, route_mtu - 28 if route_mtu else None)
+    finally:
+        if pinger:
+            pinger.close()
+    mtu = payload + 28 if payload is not None else None
     if mtu:
         print(f"  Path MTU ≈ {mtu} bytes")
     else:
@@ -450,30 +1157,94 @@ def mtu_test(host: str = "8.8.8.8"):
     return mtu
 
 
-def dns_test(domain: str = "google.com", resolvers=None, timeout: float = 1.0):
+# (nameserver, lifetime) -> dns.asyncresolver.Resolver, built once per process
+_DNS_RESOLVERS = {}
+
+
+def get_resolver(nameserver: str, timeout: float):
+    """
+    Return a shared async resolver that queries only 'nameserver'.
+    """
+    key = (nameserver, timeout)
+    res = _DNS_RESOLVERS.get(key)
+    if res is None:
+        res = dns.asyncresolver.Resolver(configure=False)
+        res.nameservers = [nameserver]
+        res.lifetime = timeout
+        _DNS_RESOLVERS[key] = res
+    return res
+
+
+def dns_test(domain: str = "google.com", resolvers=None, timeout: float = 1.0, repeats: int = 3):
     """
     Time A-record lookups against each resolver.
+    All lookups run concurrently; each resolver is queried 'repeats' times
+    and the fastest answer is reported.
     """
     print("\n=== DNS Lookup Test ===")
     if resolvers is None:
         resolvers = ["1.1.1.1", "8.8.8.8"]
-    results = {}
-    for r in resolvers:
-        res = dns.resolver.Resolver(configure=False)
-        res.nameservers = [r]
-        res.lifetime = timeout
+
+    async def time_lookup(r):
+        res = get_resolver(r, timeout)
         start = time.monotonic()
-        try:
-            _answer = res.resolve(domain, "A")
-            delay = (time.monotonic() - start) * 1000.0
+        await res.resolve(domain, "A")
+        return (time.monotonic() - start) * 1000.0
+
+    async def run_all():
+        lookups = [time_lookup(r) for r in resolvers for _ in range(repeats)]
+        return await asyncio.gather(*lookups, return_exceptions=True)
+
+    outcomes = asyncio.run(run_all())
+    results = {}
+    for i, r in enumerate(resolvers):
+        attempts = outcomes[i * repeats:(i + 1) * repeats]
+        delays = [d for d in attempts if not isinstance(d, BaseException)]
+        if delays:
+            delay = min(delays)
             print(f"  {r} → {delay:.1f} ms")
             results[r] = delay
-        except Exception as e:
-            print(f"  {r} → ERROR: {e}")
+        else:
+            print(f"  {r} → ERROR: {attempts[0]}")
             results[r] = None
     return results
 
 
+def get_public_ip() -> str:
+    """
+    Return the public IP reported by ipify, reusing it for PUBLIC_IP_TTL seconds.
+    """
+    global _public_ip_cache
+    fetched_at, ip = _public_ip_cache
+    if ip and time.monotonic() - fetched_at < PUBLIC_IP_TTL:
+        return ip
+    ip = _HTTP.get("https://api.ipify.org", timeout=3).text.strip()
+    _public_ip_cache = (time.monotonic(), ip)
+    return ip
+
+
+_upnp_igd = None
+_upnp_lock = threading.Lock()
+
+
+def get_upnp_igd():
+    """
+    Return a miniupnpc.UPnP with its Internet Gateway Device selected.
+    Discovery and IGD selection run once per process; later calls reuse the
+    result. Returns None if no UPnP device answered.
+    """
+    global _upnp_igd
+    with _upnp_lock:
+        if _upnp_igd is None:
+            upnp = miniupnpc.UPnP()
+            upnp.discoverdelay = 200
+            if upnp.discover() == 0:
+                return None
+            upnp.selectigd()
+            _upnp_igd = upnp
+        return _upnp_igd
+
+
 def cgnat_test():
     """
     Compare router's external IP via UPnP (if available) to public IP from ipify.
@@ -481,7 +1252,7 @@ def cgnat_test():
     print("\n=== CG-NAT Check ===")
     public_ip = None
     try:
-        public_ip = requests.get("https://api.ipify.org", timeout=3).text.strip()
+        public_ip = get_public_ip()
     except Exception:
         print("  ERROR fetching public IP")
         return None
@@ -492,15 +1263,13 @@ def cgnat_test():
         return {"public_ip": public_ip, "router_ip": None, "cgnat": None}
 
     try:
-        upnp = miniupnpc.UPnP()
-        upnp.discoverdelay = 200
-        discovered = upnp.discover()
-        if discovered == 0:
+        upnp = get_upnp_igd()
+        if upnp is None:
             print("  No UPnP devices found on network")
             return {"public_ip": public_ip, "router_ip": None, "cgnat": None}
         
-        upnp.selectigd()
-        router_ext = upnp.externalipaddress()
+        with _upnp_lock:
+            router_ext = upnp.externalipaddress()
         
         if not router_ext or router_ext == "0.0.0.0":
             print("  Router UPnP available but no external IP reported")
@@ -540,6 +1309,16 @@ def main():
                    help="Save detailed results to file (default: network_diagnostics.txt)")
     p.add_argument("--mtr-count", type=int, default=200,
                    help="Number of MTR packets to send (default: 200 for thorough analysis)")
+    p.add_argument("--streams", type=int, default=8,
+                   help="Parallel TCP streams for bufferbloat load (default: 8)")
+    p.add_argument("--omit", type=int, default=2,
+                   help="Seconds of TCP slow start to omit from bufferbloat load (default: 2)")
+    p.add_argument("--concurrent-load", action="store_true",
+                   help="Load upload and download at once on two server ports (faster, less precise)")
+    p.add_argument("--no-cache", action="store_true",
+                   help="Neither read nor write the cached iperf3 server choice")
+    p.add_argument("--refresh-servers", action="store_true",
+                   help="Ignore the cached iperf3 server and re-test all servers")
     p.add_argument("--quick", action="store_true",
                    help="Quick single run mode (disables multiple runs and logging)")
     args = p.parse_args()
@@ -563,12 +1342,21 @@ def main():
     # Initialize logging if output file specified
     log_file = None
     if args.output:
-        log_file = open(args.output, 'w')
+        # Large buffer, flushed once on close (atexit covers early exits)
+        log_file = open(args.output, 'w', buffering=1 << 16)
+        atexit.register(log_file.close)
         log_file.write(f"Network Diagnostics Report - {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
         log_file.write("=" * 60 + "\n\n")
 
-    # Select iperf3 server
-    if args.iperf3_server:
+    # Select iperf3 server, reusing a recently verified one when possible
+    cached = None
+    if not args.no_cache and not args.refresh_servers:
+        cached = load_server_cache(args.iperf3_server, need_udp=not args.quick)
+    if cached:
+        iperf_server, iperf_port = cached["server"], cached["port"]
+        support = "TCP + UDP support" if cached["udp"] else "TCP only - UDP tests may fail"
+        print(f"Using cached iperf3 server {iperf_server}:{iperf_port} ({support})")
+    elif args.iperf3_server:
         iperf_server = args.iperf3_server
         # Check if server is in our list to get the port
         if iperf_server in IPERF3_SERVERS:
@@ -577,31 +1365,33 @@ def main():
             ports = config["ports"]
             description = config["description"]
             print(f"Testing specified server {iperf_server} ({description})...")
+            resolve_host(iperf_server)
             
             working_port = None
             udp_support = False
-            
-            for port in ports:
-                print(f"  Trying port {port}...", end=" ")
-                if test_server_connectivity(iperf_server, port, timeout=3):
-                    print("TCP ✓", end=" ")
-                    
-                    # Test UDP support
-                    print("UDP...", end=" ")
-                    if test_udp_support(iperf_server, port, timeout=5):
-                        print("✓")
-                        working_port = port
-                        udp_support = True
-                        break
-                    else:
-                        print("✗")
-                        if working_port is None:  # Keep first working TCP port as fallback
-                            working_port = port
-                else:
-                    print("TCP ✗")
-            
+
+            alive = probe_ports_bulk([(iperf_server, port) for port in ports])
+            open_ports = [port for port in ports if (iperf_server, port) in alive]
+            print(f"  {len(open_ports)}/{len(ports)} ports open")
+
+            for port in open_ports:
+                if args.quick:
+                    working_port = port  # Quick mode skips the UDP probe
+                    break
+                print(f"  Trying port {port} UDP...", end=" ")
+                if test_udp_support(iperf_server, port):
+                    print("✓")
+                    working_port = port
+                    udp_support = True
+                    break
+                print("✗")
+                if working_port is None:  # Keep first working TCP port as fallback
+                    working_port = port
+
             if working_port:
                 iperf_port = working_port
+                if not args.no_cache:
+                    save_server_cache(iperf_server, iperf_port, udp_support)
                 if udp_support:
                     print(f"Using {iperf_server}:{iperf_port} (TCP + UDP support)")
                 else:
@@ -614,26 +1404,32 @@ def main():
             print(f"Using specified iperf3 server: {iperf_server}:{iperf_port}")
             print("Note: Custom server - UDP support unknown")
     else:
-        iperf_server, iperf_port = select_best_server()
+        iperf_server, iperf_port = select_best_server(check_udp=not args.quick,
+                                                      cache=not args.no_cache)
+
+    concurrent_port = None
+    if args.concurrent_load:
+        concurrent_port = find_spare_port(iperf_server, iperf_port)
+        if concurrent_port:
+            print(f"Concurrent load: download via {iperf_server}:{concurrent_port}")
+        else:
+            print("Concurrent load: no second open port on this server, testing sequentially")
 
     # Run tests (single or multiple runs)
     if args.runs == 1:
         # Single run mode
         print(f"\n=== Running Single Diagnostic Test ===")
-        results = run_single_test(iperf_server, iperf_port, args.ping_host, args.mtr_count, log_file)
+        results = run_single_test(iperf_server, iperf_port, args.ping_host, args.mtr_count, log_file,
+                                  streams=args.streams, omit=args.omit,
+                                  concurrent_port=concurrent_port)
         display_final_summary(results, log_file)
     else:
-        # Multiple runs mode with intelligent batching
+        # Multiple runs mode
         print(f"\n=== Running {args.runs} Tests for Comprehensive Analysis ===")
-        
-        # Auto-enable parallel for stress testing if many runs
-        effective_parallel = args.parallel
-        if args.runs >= 6 and args.parallel == 1:
-            effective_parallel = 2
-            print(f"Auto-enabling parallel execution ({effective_parallel} threads) for stress testing")
-        
         all_results = run_multiple_tests(iperf_server, iperf_port, args.ping_host, args.mtr_count, 
-                                       args.runs, effective_parallel, log_file)
+                                       args.runs, args.parallel, log_file,
+                                       streams=args.streams, omit=args.omit,
+                                       cooldown=not args.quick, concurrent_port=concurrent_port)
         display_statistical_summary(all_results, log_file)
 
     if log_file:
@@ -642,16 +1438,94 @@ def main():
         print("💡 Use this file as evidence when contacting your ISP about network issues")
 
 
-def run_single_test(iperf_server, iperf_port, ping_host, mtr_count, log_file):
-    """Run a single complete diagnostic test."""
+class ThreadLocalStdout:
+    """
+    sys.stdout proxy that sends a thread's writes to that thread's buffer
+    while one is set, and to the real stream otherwise.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def target(self):
+        buffer = getattr(self.local, "buffer", None)
+        return self.stream if buffer is None else buffer
+
+    def write(self, text):
+        return self.target().write(text)
+
+    def flush(self):
+        self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+_stdout_lock = threading.Lock()
+
+
+def run_captured(func, *args, **kwargs):
+    """
+    Call func with everything it prints from this thread buffered, so tests
+    running concurrently do not interleave their output.
+    Returns (result, output). On an exception the output is passed through.
+    """
+    with _stdout_lock:
+        if not isinstance(sys.stdout, ThreadLocalStdout):
+            sys.stdout = ThreadLocalStdout(sys.stdout)
+        proxy = sys.stdout
+    previous = getattr(proxy.local, "buffer", None)
+    buffer = io.StringIO()
+    proxy.local.buffer = buffer
+    try:
+        result = func(*args, **kwargs)
+    except BaseException:
+        proxy.local.buffer = previous
+        proxy.write(buffer.getvalue())
+        raise
+    proxy.local.buffer = previous
+    return result, buffer.getvalue()
+
+
+def run_bandwidth_dependent(iperf_server, iperf_port, ping_host, streams=8, omit=2,
+                            concurrent_port=None):
+    """Run the tests that load the link; these must never overlap each other."""
     results = {}
-    
-    results['bufferbloat'] = bufferbloat_test(iperf_server, iperf_port, ping_host)
+    results['bufferbloat'] = bufferbloat_test(iperf_server, iperf_port, ping_host,
+                                              streams=streams, omit=omit,
+                                              concurrent_port=concurrent_port)
     results['jitter'] = jitter_test(iperf_server, iperf_port)
-    results['mtr'] = mtr_test(count=mtr_count)
-    results['mtu'] = mtu_test()
-    results['dns'] = dns_test()
-    results['cgnat'] = cgnat_test()
+    return results
+
+
+def run_independent(mtr_count):
+    """
+    Run the tests that barely load the link, concurrently.
+    Each test's output is buffered and printed as one block, in a fixed order.
+    """
+    tests = {
+        'mtr': (mtr_test, {'count': mtr_count}),
+        'mtu': (mtu_test, {}),
+        'dns': (dns_test, {}),
+        'cgnat': (cgnat_test, {}),
+    }
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(tests)) as executor:
+        futures = {name: executor.submit(run_captured, func, **kwargs)
+                   for name, (func, kwargs) in tests.items()}
+        for name, future in futures.items():
+            results[name], output = future.result()
+            sys.stdout.write(output)
+    return results
+
+
+def run_single_test(iperf_server, iperf_port, ping_host, mtr_count, log_file, streams=8, omit=2,
+                    concurrent_port=None):
+    """Run a single complete diagnostic test."""
+    results = run_bandwidth_dependent(iperf_server, iperf_port, ping_host, streams=streams, omit=omit,
+                                      concurrent_port=concurrent_port)
+    results.update(run_independent(mtr_count))
     
     if log_file:
         log_test_results(results, log_file, run_number=1)
@@ -659,62 +1533,91 @@ def run_single_test(iperf_server, iperf_port, ping_host, mtr_count, log_file):
     return results
 
 
-def run_multiple_tests(iperf_server, iperf_port, ping_host, mtr_count, num_runs, parallel, log_file):
-    """Run multiple diagnostic tests and collect statistics."""
-    all_results = []
-    results_queue = queue.Queue()
+def run_multiple_tests(iperf_server, iperf_port, ping_host, mtr_count, num_runs, parallel, log_file,
+                       streams=8, omit=2, cooldown=True, concurrent_port=None):
+    """
+    Run multiple diagnostic tests and collect statistics.
+    Bufferbloat and jitter always run one at a time: an iperf3 server serves a
+    single client, and concurrent loads share the client's uplink, so
+    overlapping runs would measure each other. Only the MTR/MTU/DNS/CG-NAT
+    tests run up to 'parallel' at once, after all load tests are done.
+    With cooldown, each load run is followed by a wait until ping RTT is back
+    at its baseline, keeping runs statistically independent.
+    """
+    if parallel > 1:
+        print(f"Note: bufferbloat/jitter tests always run serially (iperf3 servers accept one "
+              f"client at a time); --parallel {parallel} applies to MTR/MTU/DNS/CG-NAT only")
     
-    def run_test_worker(run_id):
-        print(f"  Run {run_id}: Starting...")
+    all_results = []
+    for run_id in range(1, num_runs + 1):
+        print(f"  Run {run_id}: Starting bandwidth tests...")
+        # Runs are logged after their later phase, so keep when each one began
+        started = time.strftime('%Y-%m-%d %H:%M:%S')
         try:
-            results = run_single_test(iperf_server, iperf_port, ping_host, mtr_count, log_file)
+            results = run_bandwidth_dependent(iperf_server, iperf_port, ping_host,
+                                              streams=streams, omit=omit,
+                                              concurrent_port=concurrent_port)
             results['run_id'] = run_id
-            results_queue.put(results)
-            print(f"  Run {run_id}: Complete")
         except Exception as e:
             print(f"  Run {run_id}: Failed - {e}")
-            results_queue.put({'run_id': run_id, 'error': str(e)})
-    
-    # Run tests in batches if parallel > 1
-    remaining_runs = list(range(1, num_runs + 1))
-    
-    while remaining_runs:
-        # Create batch of parallel runs
-        batch_size = min(parallel, len(remaining_runs))
-        current_batch = remaining_runs[:batch_size]
-        remaining_runs = remaining_runs[batch_size:]
-        
-        # Start threads for current batch
-        threads = []
-        for run_id in current_batch:
-            thread = threading.Thread(target=run_test_worker, args=(run_id,))
-            thread.start()
-            threads.append(thread)
+            results = {'run_id': run_id, 'error': str(e)}
+        results['timestamp'] = started
+        all_results.append(results)
         
-        # Wait for batch to complete
-        for thread in threads:
-            thread.join()
+        baseline = (results.get('bufferbloat') or {}).get('baseline_avg')
+        if cooldown and baseline and run_id < num_runs:
+            waited = wait_for_quiescence(ping_host, baseline)
+            print(f"  Cooldown: {waited:.1f}s")
     
-    # Collect all results
-    while not results_queue.empty():
-        all_results.append(results_queue.get())
+    def run_independent_worker(results):
+        run_id = results['run_id']
+        if 'error' in results:
+            return
+        # These tests start after every run's load phase, not right after this one's
+        results['independent_timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            independent, output = run_captured(run_independent, mtr_count)
+            results.update(independent)
+            # One write per run keeps concurrent runs' reports apart
+            sys.stdout.write(f"\n--- Run {run_id} ---{output}")
+            print(f"  Run {run_id}: Complete")
+        except Exception as e:
+            print(f"  Run {run_id}: Failed - {e}")
+            results['error'] = str(e)
+            return
+        # Log as soon as the run is complete, so an interrupt keeps finished runs
+        if log_file:
+            log_test_results(results, log_file, run_number=run_id)
+    
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        list(executor.map(run_independent_worker, all_results))
     
-    return sorted(all_results, key=lambda x: x.get('run_id', 0))
+    return all_results
+
+
+# Result keys that describe the run rather than hold a test's results
+_RUN_METADATA_KEYS = ('run_id', 'timestamp', 'independent_timestamp')
+
+_log_lock = threading.Lock()
 
 
 def log_test_results(results, log_file, run_number):
     """Log detailed test results to file."""
-    log_file.write(f"=== Test Run {run_number} ===\n")
-    log_file.write(f"Timestamp: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-    
-    # Log each test result
-    for test_name, result in results.items():
-        if result:
-            log_file.write(f"{test_name.upper()} Results:\n")
-            log_file.write(f"{json.dumps(result, indent=2)}\n\n")
-    
-    log_file.write("-" * 40 + "\n\n")
-    log_file.flush()
+    timestamp = results.get('timestamp') or time.strftime('%Y-%m-%d %H:%M:%S')
+    with _log_lock:
+        log_file.write(f"=== Test Run {run_number} ===\n")
+        log_file.write(f"Timestamp: {timestamp}\n")
+        if results.get('independent_timestamp'):
+            log_file.write(f"MTR/MTU/DNS/CG-NAT started: {results['independent_timestamp']}\n")
+        log_file.write("\n")
+        
+        # Log each test result
+        for test_name, result in results.items():
+            if result and test_name not in _RUN_METADATA_KEYS:
+                log_file.write(f"{test_name.upper()} Results:\n")
+                log_file.write(f"{json_dumps(result)}\n\n")
+        
+        log_file.write("-" * 40 + "\n\n")
 
 
 def display_statistical_summary(all_results, log_file):
@@ -740,17 +1643,20 @@ def display_statistical_summary(all_results, log_file):
     print(f"📊 Analyzing {len(valid_results)} successful runs")
     print()
     
+    # One pass over the runs feeds every analyzer
+    stats = collect_stats(valid_results)
+    
     # Bufferbloat statistics
-    analyze_bufferbloat_stats(valid_results)
+    analyze_bufferbloat_stats(stats)
     
     # Jitter statistics  
-    analyze_jitter_stats(valid_results)
+    analyze_jitter_stats(stats)
     
     # DNS statistics
-    analyze_dns_stats(valid_results)
+    analyze_dns_stats(stats)
     
     # MTR statistics (enhanced)
-    analyze_mtr_stats(valid_results)
+    analyze_mtr_stats(stats)
     
     if log_file:
         log_file.write("STATISTICAL SUMMARY\n")
@@ -759,107 +1665,135 @@ def display_statistical_summary(all_results, log_file):
         log_file.write(f"Failed runs: {len(failed_runs)}\n\n")
 
 
-def analyze_bufferbloat_stats(results):
-    """Analyze bufferbloat test statistics across multiple runs."""
-    baseline_rtts = []
-    upload_increases = []
-    download_increases = []
-    grades = []
-    
+def summarize(values) -> tuple:
+    """Return (min, max, mean) of a non-empty list of floats."""
+    return min(values), max(values), sum(values) / len(values)
+
+
+def collect_stats(results):
+    """
+    Gather the metrics of every run in a single pass over results.
+    Returns a dict of per-test accumulators consumed by the analyze_* helpers.
+    """
+    bufferbloat = defaultdict(list)
+    grades = Counter()
+    jitter_stats = defaultdict(list)
+    dns_times = defaultdict(list)
+    all_hops = defaultdict(lambda: [0, 0.0, 0.0, 0.0])  # hop -> [count, max_loss, sum_rtt, max_stdev]
+
     for result in results:
         buf = result.get('bufferbloat')
         if buf:
             if buf.get('baseline_avg'):
-                baseline_rtts.append(buf['baseline_avg'])
-            if buf.get('upload_avg') and buf.get('baseline_avg'):
-                upload_increases.append(buf['upload_avg'] - buf['baseline_avg'])
-            if buf.get('download_avg') and buf.get('baseline_avg'):
-                download_increases.append(buf['download_avg'] - buf['baseline_avg'])
+                bufferbloat['baseline'].append(buf['baseline_avg'])
+            if buf.get('upload_increase') is not None:
+                bufferbloat['upload'].append(buf['upload_increase'])
+            if buf.get('download_increase') is not None:
+                bufferbloat['download'].append(buf['download_increase'])
+            if buf.get('combined_increase') is not None:
+                bufferbloat['combined'].append(buf['combined_increase'])
             if buf.get('grade'):
-                grades.append(buf['grade'])
-    
-    print("🌐 BUFFERBLOAT ANALYSIS")
-    if baseline_rtts:
-        print(f"   Baseline RTT: {min(baseline_rtts):.1f} - {max(baseline_rtts):.1f} ms (avg: {statistics.mean(baseline_rtts):.1f})")
-    if upload_increases:
-        print(f"   Upload impact: {min(upload_increases):.1f} - {max(upload_increases):.1f} ms (avg: {statistics.mean(upload_increases):.1f})")
-    if download_increases:
-        print(f"   Download impact: {min(download_increases):.1f} - {max(download_increases):.1f} ms (avg: {statistics.mean(download_increases):.1f})")
-    if grades:
-        grade_counts = {g: grades.count(g) for g in set(grades)}
-        print(f"   Grades: {grade_counts}")
-    print()
+                grades[buf['grade']] += 1
 
-
-def analyze_jitter_stats(results):
-    """Analyze jitter test statistics across multiple runs.""" 
-    jitters = []
-    loss_rates = []
-    
-    for result in results:
         jitter = result.get('jitter')
         if jitter:
             if jitter.get('jitter_ms'):
-                jitters.append(jitter['jitter_ms'])
-            if jitter.get('lost') is not None and jitter.get('total'):
-                loss_rate = (jitter['lost'] / jitter['total']) * 100
-                loss_rates.append(loss_rate)
-    
-    print("📡 JITTER & PACKET LOSS ANALYSIS")
-    if jitters:
-        print(f"   Jitter: {min(jitters):.1f} - {max(jitters):.1f} ms (avg: {statistics.mean(jitters):.1f})")
-    if loss_rates:
-        print(f"   Packet loss: {min(loss_rates):.3f}% - {max(loss_rates):.3f}% (avg: {statistics.mean(loss_rates):.3f}%)")
-    print()
+                jitter_stats['jitter'].append(jitter['jitter_ms'])
+            if jitter.get('loss_pct') is not None:
+                jitter_stats['loss'].append(jitter['loss_pct'])
 
-
-def analyze_dns_stats(results):
-    """Analyze DNS lookup statistics across multiple runs."""
-    dns_times = {'1.1.1.1': [], '8.8.8.8': []}
-    
-    for result in results:
         dns = result.get('dns')
         if dns:
             for resolver, time_ms in dns.items():
-                if time_ms is not None and resolver in dns_times:
+                if time_ms is not None:
                     dns_times[resolver].append(time_ms)
-    
-    print("🔍 DNS LOOKUP ANALYSIS")
-    for resolver, times in dns_times.items():
-        if times:
-            print(f"   {resolver}: {min(times):.1f} - {max(times):.1f} ms (avg: {statistics.mean(times):.1f})")
-    print()
-
 
-def analyze_mtr_stats(results):
-    """Enhanced MTR analysis with hop-by-hop statistics."""
-    print("🛣️  MTR ROUTE ANALYSIS")
-    
-    # Collect all MTR results
-    all_hops = {}  # hop_number -> list of (loss, avg_rtt, stdev)
-    
-    for result in results:
         mtr = result.get('mtr')
         if mtr:
             for hop, loss, avg, stdev in mtr:
-                if hop not in all_hops:
-                    all_hops[hop] = []
-                all_hops[hop].append((loss, avg, stdev))
+                acc = all_hops[hop]
+                acc[0] += 1
+                if loss > acc[1]:
+                    acc[1] = loss
+                acc[2] += avg
+                if stdev > acc[3]:
+                    acc[3] = stdev
+
+    return {'bufferbloat': bufferbloat, 'grades': grades, 'jitter': jitter_stats,
+            'dns': dns_times, 'mtr': all_hops}
+
+
+def analyze_bufferbloat_stats(stats):
+    """Analyze bufferbloat test statistics across multiple runs."""
+    buf = []
+    _w = buf.append
+    bloat = stats['bufferbloat']
+    
+    _w("🌐 BUFFERBLOAT ANALYSIS\n")
+    if bloat['baseline']:
+        lo, hi, avg = summarize(bloat['baseline'])
+        _w(f"   Baseline RTT: {lo:.1f} - {hi:.1f} ms (avg: {avg:.1f})\n")
+    if bloat['upload']:
+        lo, hi, avg = summarize(bloat['upload'])
+        _w(f"   Upload impact: {lo:.1f} - {hi:.1f} ms (avg: {avg:.1f})\n")
+    if bloat['download']:
+        lo, hi, avg = summarize(bloat['download'])
+        _w(f"   Download impact: {lo:.1f} - {hi:.1f} ms (avg: {avg:.1f})\n")
+    if bloat['combined']:
+        # --concurrent-load runs: upload and download loaded at the same time
+        lo, hi, avg = summarize(bloat['combined'])
+        _w(f"   Bidirectional impact: {lo:.1f} - {hi:.1f} ms (avg: {avg:.1f})\n")
+    if stats['grades']:
+        _w(f"   Grades: {dict(stats['grades'])}\n")
+    _w("\n")
+    sys.stdout.write("".join(buf))
+
+
+def analyze_jitter_stats(stats):
+    """Analyze jitter test statistics across multiple runs.""" 
+    buf = []
+    _w = buf.append
+    jitter = stats['jitter']
+    
+    _w("📡 JITTER & PACKET LOSS ANALYSIS\n")
+    if jitter['jitter']:
+        lo, hi, avg = summarize(jitter['jitter'])
+        _w(f"   Jitter: {lo:.1f} - {hi:.1f} ms (avg: {avg:.1f})\n")
+    if jitter['loss']:
+        lo, hi, avg = summarize(jitter['loss'])
+        _w(f"   Packet loss: {lo:.3f}% - {hi:.3f}% (avg: {avg:.3f}%)\n")
+    _w("\n")
+    sys.stdout.write("".join(buf))
+
+
+def analyze_dns_stats(stats):
+    """Analyze DNS lookup statistics across multiple runs."""
+    buf = []
+    _w = buf.append
+    _w("🔍 DNS LOOKUP ANALYSIS\n")
+    for resolver, times in stats['dns'].items():
+        lo, hi, avg = summarize(times)
+        _w(f"   {resolver}: {lo:.1f} - {hi:.1f} ms (avg: {avg:.1f})\n")
+    _w("\n")
+    sys.stdout.write("".join(buf))
+
+
+def analyze_mtr_stats(stats):
+    """Enhanced MTR analysis with hop-by-hop statistics."""
+    buf = []
+    _w = buf.append
+    _w("🛣️  MTR ROUTE ANALYSIS\n")
+    all_hops = stats['mtr']
     
     if not all_hops:
-        print("   No MTR data available")
+        _w("   No MTR data available\n")
+        sys.stdout.write("".join(buf))
         return
     
-    print("   Hop-by-hop analysis:")
+    _w("   Hop-by-hop analysis:\n")
     for hop in sorted(all_hops.keys()):
-        hop_data = all_hops[hop]
-        losses = [d[0] for d in hop_data]
-        rtts = [d[1] for d in hop_data]
-        stdevs = [d[2] for d in hop_data]
-        
-        max_loss = max(losses)
-        avg_rtt = statistics.mean(rtts)
-        max_stdev = max(stdevs)
+        count, max_loss, sum_rtt, max_stdev = all_hops[hop]
+        avg_rtt = sum_rtt / count
         
         status = ""
         if max_loss > 0:
@@ -869,9 +1803,10 @@ def analyze_mtr_stats(results):
         if not status:
             status = " ✅"
             
-        print(f"   Hop {hop:2d}: {avg_rtt:6.1f}ms avg, {max_loss:4.1f}% max loss, {max_stdev:5.1f}ms max jitter{status}")
+        _w(f"   Hop {hop:2d}: {avg_rtt:6.1f}ms avg, {max_loss:4.1f}% max loss, {max_stdev:5.1f}ms max jitter{status}\n")
     
-    print()
+    _w("\n")
+    sys.stdout.write("".join(buf))
 
 
 def display_final_summary(results, log_file):